@@ -32,6 +32,43 @@ import asyncio
 import base64
 import json
 
+# for response compression
+import gzip
+import hashlib
+import contextvars
+from fastapi import Response
+
+# brotli / zstd are optional extras; we only advertise what is installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# for the recently-played play log
+from array import array
+import bisect
+
+# for the library search index
+import unicodedata
+import heapq
+
+# for the off-loop logging pipeline
+import sys
+import queue
+import random
+import atexit
+from logging.handlers import QueueHandler, QueueListener
+
+# for the opt-in request profiler
+import cProfile
+import marshal
+import itertools
+from collections import deque
+
 logger = logging.getLogger(__name__)
 
 # Add this line near your other global variables to get the logger
@@ -39,6 +76,78 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# --- LOGGING PIPELINE ---
+# The request path only formats the record and puts it on a queue; a QueueListener
+# thread does the actual (blocking) write, so logging never stalls the event loop.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+PAYLOAD_LOG_SAMPLE_RATE = float(os.getenv("PAYLOAD_LOG_SAMPLE_RATE", "0.01"))  # share of payload logs kept
+PAYLOAD_LOG_MAX_CHARS = int(os.getenv("PAYLOAD_LOG_MAX_CHARS", "2000"))
+# Per-request fields stamped on every record: {"route", "upstream", "start"}
+REQUEST_LOG_CONTEXT = contextvars.ContextVar("request_log_context", default=None)
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds route / upstream / latency_ms of the current request to each record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        ctx = REQUEST_LOG_CONTEXT.get()
+        if ctx is None:
+            record.route, record.upstream, record.latency_ms = "-", "-", "-"
+        else:
+            record.route = ctx["route"]
+            record.upstream = ctx["upstream"]
+            record.latency_ms = f"{(time.perf_counter() - ctx['start']) * 1000:.1f}"
+        return True
+
+
+def setup_logging() -> QueueListener:
+    """Routes this module's logger through a queue; returns the (started) listener."""
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    # Runs on the caller's side, where the request contextvar is visible
+    queue_handler.addFilter(RequestContextFilter())
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(logging.Formatter(
+        "%(asctime)s %(levelname)s %(name)s route=%(route)s upstream=%(upstream)s latency_ms=%(latency_ms)s %(message)s"
+    ))
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    logger.handlers = [queue_handler]
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    listener.start()
+    atexit.register(listener.stop)  # flush whatever is still queued on shutdown
+    return listener
+
+
+LOG_LISTENER = setup_logging()
+
+
+def truncate_payload(text: str) -> str:
+    """Caps a payload for logging, keeping a note of how much was cut."""
+    if text is None or len(text) <= PAYLOAD_LOG_MAX_CHARS:
+        return text
+    return f"{text[:PAYLOAD_LOG_MAX_CHARS]}... [{len(text) - PAYLOAD_LOG_MAX_CHARS} more chars]"
+
+
+def log_payload(label: str, text: str) -> None:
+    """
+    Logs a (possibly huge) upstream body, but only for a PAYLOAD_LOG_SAMPLE_RATE
+    share of calls and never more than PAYLOAD_LOG_MAX_CHARS of it.
+    The sampling decision is made before any formatting work happens.
+    """
+    if random.random() >= PAYLOAD_LOG_SAMPLE_RATE or not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info("%s: %s", label, truncate_payload(text))
+
+
+def note_upstream(name: str) -> None:
+    """Records which upstream (spotify / openrouter / clipdrop) the current request is talking to."""
+    ctx = REQUEST_LOG_CONTEXT.get()
+    if ctx is not None:
+        ctx["upstream"] = name
+
 # temporary in-memory store for one-time auth codes -> tokens
 AUTH_CODES = {}  # map code -> {"tokens": {...}, "expires_at": epoch_seconds}
 AUTH_CODE_TTL = 300  # seconds (5 minutes)
@@ -54,7 +163,7 @@ SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 # genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 # GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-print("Redirect URI in use:", SPOTIFY_REDIRECT_URI)
+logger.info("Redirect URI in use: %s", SPOTIFY_REDIRECT_URI)
 
 AUTH_BASE = "https://accounts.spotify.com/authorize"
 TOKEN_URL = "https://accounts.spotify.com/api/token"
@@ -69,8 +178,376 @@ app.add_middleware(SessionMiddleware, secret_key=APP_SECRET_KEY, max_age=7*24*36
 # We use this to ask Spotify for *only* the data we need.
 TOP_TRACKS_FIELDS = "items(id,name,duration_ms,album(images),artists(name))"
 TOP_ARTISTS_FIELDS = "items(id,name,genres,images)"
+PLAYLIST_TRACKS_FIELDS = "items(track(id,name,album(images),artists(name)))"
+TIME_RANGES = ["short_term", "medium_term", "long_term"]
+
+# Server-side response cache for Spotify GETs, shared by the routes and the login prefetch
+RESPONSE_CACHE = {}  # map (user_key, path, params) -> {"data": {...}, "expires_at": epoch_seconds}
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))  # seconds
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+INFLIGHT_FETCHES = {}  # same key -> asyncio.Task, so a route can join a prefetch already on the wire
+SHARED_CLIENT = {"client": None, "loop": None}  # see shared_http_client()
+
+# Post-login cache warm-up
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "4"))  # upstream calls in flight per user
+PREFETCH_PLAYLIST_TRACKS = int(os.getenv("PREFETCH_PLAYLIST_TRACKS", "3"))  # first N playlists to warm
+PREFETCH_TASKS = {}  # map user_key -> asyncio.Task (one warm-up per user at a time)
+
+# Full-library fetches (every playlist page, every track page)
+PAGINATION_CONCURRENCY = int(os.getenv("PAGINATION_CONCURRENCY", "8"))  # pages in flight per request
+PAGINATION_MAX_RETRIES = 3  # per page, on 429 from Spotify
+PAGINATION_MAX_RETRY_WAIT = 30  # seconds; a longer Retry-After is cut to this
+PLAYLIST_TRACK_IDS = {}  # map (playlist_id, snapshot_id) -> [track_id, ...]; a new snapshot_id means a refetch
+PLAYLIST_TRACK_IDS_MAX_ENTRIES = int(os.getenv("PLAYLIST_TRACK_IDS_MAX_ENTRIES", "20000"))
+
+# Recently-played ingestion (needs the 'user-read-recently-played' scope in SPOTIFY_SCOPES)
+PLAY_LOGS = {}  # map user_key -> play log dict, see get_play_log()
+INGEST_TASKS = {}  # map user_key -> asyncio.Task polling /me/player/recently-played for that session
+RECENTLY_PLAYED_POLL_INTERVAL = int(os.getenv("RECENTLY_PLAYED_POLL_INTERVAL", "900"))  # seconds; Spotify keeps only 50 plays
+RECENTLY_PLAYED_MAX_PAGES = 10  # per ingestion run, when more than 50 plays piled up
+HISTORY_BUCKETS = {"hour": 3600 * 1000, "day": 24 * 3600 * 1000, "week": 7 * 24 * 3600 * 1000}  # in ms
+
+# Per-user library search index (all playlists + saved tracks; saved needs 'user-library-read')
+LIBRARY_INDEXES = {}  # map user_key -> index dict, see get_library_index()
+LIBRARY_TASKS = {}  # map user_key -> asyncio.Task running a (re)build
+LIBRARY_REFRESH_INTERVAL = int(os.getenv("LIBRARY_REFRESH_INTERVAL", "600"))  # seconds before a search triggers a refresh
+LIBRARY_REFRESH_BACKOFF = int(os.getenv("LIBRARY_REFRESH_BACKOFF", "60"))  # seconds without refreshes after a failed one
+LIBRARY_TRACK_FIELDS = "items(track(id,name,album(name,images),artists(name))),total"
+LIBRARY_SAVED_SOURCE = "saved"  # source key for /me/tracks; playlist ids are the other source keys
+LIBRARY_INDEX_CHUNK = 200  # items indexed between yields to the event loop (a few ms of CPU)
+
+# Admission control: each route class gets its own concurrency limit and bounded wait queue,
+# so a burst of 30-150s AI jobs can't take the capacity that /me and /me/top need.
+ADMISSION_CLASSES = {
+    # class: limit = running at once, queue = max waiting, timeout = max wait (s), retry_after = hint (s)
+    "ai": {
+        "limit": int(os.getenv("ADMISSION_AI_CONCURRENCY", "4")),
+        "queue": int(os.getenv("ADMISSION_AI_QUEUE", "8")),
+        "timeout": 10.0,
+        "retry_after": 30,
+    },
+    "bulk": {
+        "limit": int(os.getenv("ADMISSION_BULK_CONCURRENCY", "4")),
+        "queue": int(os.getenv("ADMISSION_BULK_QUEUE", "16")),
+        "timeout": 15.0,
+        "retry_after": 10,
+    },
+    "read": {
+        "limit": int(os.getenv("ADMISSION_READ_CONCURRENCY", "64")),
+        "queue": int(os.getenv("ADMISSION_READ_QUEUE", "256")),
+        "timeout": 5.0,
+        "retry_after": 1,
+    },
+}
+AI_PATH_SUFFIXES = ("/ai-description", "/ai-cover")
+AI_PATHS = ("/me/ai-analysis",)
+BULK_PATHS = ("/playlists/overlap",)
+AI_JOBS_PER_USER = int(os.getenv("AI_JOBS_PER_USER", "1"))  # concurrent AI jobs one user may run
+ADMISSION_STATE = {name: {"running": 0, "waiting": 0, "semaphore": None} for name in ADMISSION_CLASSES}
+AI_JOBS_RUNNING = {}  # map user_key -> AI jobs currently admitted or queued
+
+# Opt-in per-request profiling. With neither a token nor a sample rate set, the profiling
+# middleware and the httpx span hooks are never installed, so it costs nothing.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")  # send it as 'X-Profile: <token>'; also guards /admin/profiles
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # share of requests profiled anyway
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "20"))
+PROFILING_ENABLED = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+PROFILES = deque(maxlen=PROFILE_BUFFER_SIZE)  # ring buffer of finished profiles, newest last
+PROFILE_IDS = itertools.count(1)
+# {"t0", "spans", "open", "closed"} for the request being profiled, None otherwise
+PROFILE_CONTEXT = contextvars.ContextVar("profile_context", default=None)
+PROFILE_LOCK = {"busy": False}  # cProfile hooks the whole thread, so one profiled request at a time
+
+# Response compression (negotiated via Accept-Encoding). Levels are kept low on purpose:
+# phones care about bytes, but we care about latency, and the high levels buy very little on JSON.
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))  # don't bother below this
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+# Cache entries read while handling the current request, so the middleware can
+# store compressed bodies next to them (see spotify_get_cached / compress_response)
+CACHE_ENTRIES_USED = contextvars.ContextVar("cache_entries_used", default=None)
+
+
+# --- RESPONSE COMPRESSION ---
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Picks the best encoding the client accepts and we can produce: zstd > br > gzip.
+    Entries with q=0 are treated as refused.
+    """
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    if zstandard is not None and "zstd" in accepted:
+        return "zstd"
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+@app.middleware("http")
+async def compress_response(request: Request, call_next):
+    """
+    Compresses JSON/text responses above COMPRESSION_MIN_BYTES. When the route was
+    served from RESPONSE_CACHE, the compressed bytes are stored on the cache entry
+    (keyed by encoding + body digest), so repeated hits skip the compressor entirely.
+    Every compressible response says Vary: Accept-Encoding, compressed or not.
+    """
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+    used = [] if encoding is not None else None
+    ctx_token = CACHE_ENTRIES_USED.set(used)
+    try:
+        response = await call_next(request)
+    finally:
+        CACHE_ENTRIES_USED.reset(ctx_token)
+
+    content_type = response.headers.get("content-type", "")
+    if (
+        "content-encoding" in response.headers
+        or response.status_code in (204, 304)
+        or not content_type.startswith(COMPRESSIBLE_TYPES)
+    ):
+        return response
+
+    # Another client (or a smaller body) could get a different encoding for the same URL,
+    # so shared caches must key on Accept-Encoding even when we send it uncompressed
+    response.headers.add_vary_header("Accept-Encoding")
+    if encoding is None:
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    # Work on raw headers so repeated ones (e.g. several Set-Cookie) survive
+    raw_headers = [(k, v) for k, v in response.raw_headers if k.lower() != b"content-length"]
+
+    if len(body) >= COMPRESSION_MIN_BYTES:
+        variant_key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+        compressed = next((e["encoded"][variant_key] for e in used if variant_key in e.get("encoded", {})), None)
+        if compressed is None:
+            compressed = compress_body(body, encoding)
+            for entry in used:
+                entry.setdefault("encoded", {})[variant_key] = compressed
+        body = compressed
+        raw_headers.append((b"content-encoding", encoding.encode()))
+
+    new_response = Response(content=body, status_code=response.status_code)
+    new_response.raw_headers = raw_headers + [(b"content-length", str(len(body)).encode())]
+    return new_response
+
+
+# --- ADMISSION CONTROL ---
+def route_class(path: str) -> str:
+    """Which admission class a request path belongs to: 'ai', 'bulk' or 'read'."""
+    if path in AI_PATHS or path.endswith(AI_PATH_SUFFIXES):
+        return "ai"
+    if path in BULK_PATHS:
+        return "bulk"
+    return "read"
+
+
+def shed(route_cls: str, detail: str, status_code: int = 503) -> JSONResponse:
+    """Fast rejection with a Retry-After hint, same body shape as HTTPException."""
+    retry_after = ADMISSION_CLASSES[route_cls]["retry_after"]
+    logger.warning("Shedding %s request: %s", route_cls, detail)
+    return JSONResponse(content={"detail": detail}, status_code=status_code, headers={"Retry-After": str(retry_after)})
+
+
+async def acquire_slot(route_cls: str) -> bool:
+    """
+    Takes a running slot for the class, waiting in its bounded queue if needed.
+    Returns False (without waiting) when the queue is full, or after the class timeout.
+    """
+    config = ADMISSION_CLASSES[route_cls]
+    state = ADMISSION_STATE[route_cls]
+    if state["semaphore"] is None:
+        state["semaphore"] = asyncio.Semaphore(config["limit"])
+    semaphore = state["semaphore"]
+
+    if not semaphore.locked():
+        await semaphore.acquire()  # a free slot: returns immediately
+    else:
+        if state["waiting"] >= config["queue"]:
+            return False
+        state["waiting"] += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=config["timeout"])
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            state["waiting"] -= 1
+    state["running"] += 1
+    return True
+
+
+def release_slot(route_cls: str) -> None:
+    ADMISSION_STATE[route_cls]["running"] -= 1
+    ADMISSION_STATE[route_cls]["semaphore"].release()
+
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """
+    Per-class concurrency limits with bounded, time-limited wait queues. A full queue or
+    a timed-out wait gets an immediate 503 + Retry-After instead of piling up, and one
+    user can't hold more than AI_JOBS_PER_USER AI jobs (429). Cheap reads have their own
+    class, so they keep their latency while the AI class is saturated.
+    """
+    if request.method == "OPTIONS":
+        return await call_next(request)
+
+    route_cls = route_class(request.url.path)
+    user_key = None
+    if route_cls == "ai":
+        # Same token parsing as get_current_mobile_session; a bad header is left for it to reject
+        parts = (request.headers.get("authorization") or "").split()
+        if len(parts) == 2:
+            session_data = AUTH_SESSIONS.get(parts[1])
+            user_key = cache_user_key(session_data) if session_data else None
+        if user_key is not None:
+            if AI_JOBS_RUNNING.get(user_key, 0) >= AI_JOBS_PER_USER:
+                return shed(route_cls, "Too many AI jobs in progress for this user.", status_code=429)
+            AI_JOBS_RUNNING[user_key] = AI_JOBS_RUNNING.get(user_key, 0) + 1
+
+    try:
+        if not await acquire_slot(route_cls):
+            return shed(route_cls, f"Server busy ({route_cls} requests), please retry later.")
+        try:
+            return await call_next(request)
+        finally:
+            release_slot(route_cls)
+    finally:
+        if user_key is not None:
+            AI_JOBS_RUNNING[user_key] -= 1
+            if not AI_JOBS_RUNNING[user_key]:
+                AI_JOBS_RUNNING.pop(user_key, None)
+
+
+@app.middleware("http")
+async def request_logging(request: Request, call_next):
+    """
+    Opens the per-request log context (picked up by RequestContextFilter) and writes
+    one access line per request with the final status and latency.
+    """
+    ctx = {"route": f"{request.method} {request.url.path}", "upstream": "-", "start": time.perf_counter()}
+    ctx_token = REQUEST_LOG_CONTEXT.set(ctx)
+    try:
+        response = await call_next(request)
+        # After routing, prefer the route template so /playlist/{playlist_id} groups together
+        route = request.scope.get("route")
+        if route is not None and hasattr(route, "path"):
+            ctx["route"] = f"{request.method} {route.path}"
+        logger.info("request finished status=%d", response.status_code)
+        return response
+    finally:
+        REQUEST_LOG_CONTEXT.reset(ctx_token)
+
+
+# --- PER-REQUEST PROFILING ---
+async def profile_span_start(request: httpx.Request) -> None:
+    ctx = PROFILE_CONTEXT.get()
+    if ctx is not None and not ctx["closed"]:
+        ctx["open"][id(request)] = time.perf_counter()
+
+
+async def profile_span_end(response: httpx.Response) -> None:
+    """Closes the upstream span when response headers arrive (body download not included)."""
+    ctx = PROFILE_CONTEXT.get()
+    if ctx is None or ctx["closed"]:
+        return
+    start = ctx["open"].pop(id(response.request), None)
+    if start is None:
+        return
+    ctx["spans"].append({
+        "upstream": response.request.url.host,
+        "method": response.request.method,
+        "path": response.request.url.path,
+        "status": response.status_code,
+        "start_ms": round((start - ctx["t0"]) * 1000, 2),
+        "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+    })
+
+
+def http_client(**kwargs) -> httpx.AsyncClient:
+    """
+    The httpx client every route uses for upstream calls. When profiling is configured
+    it carries the span hooks; otherwise it is a plain AsyncClient.
+    """
+    if PROFILING_ENABLED:
+        kwargs["event_hooks"] = {"request": [profile_span_start], "response": [profile_span_end]}
+    return httpx.AsyncClient(**kwargs)
+
+
+def should_profile(request: Request) -> bool:
+    if request.url.path.startswith("/admin/"):
+        return False
+    if PROFILE_TOKEN and secrets.compare_digest(request.headers.get("x-profile", ""), PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+async def profile_request(request: Request, call_next):
+    """
+    Captures a cProfile CPU profile plus the timeline of upstream calls for one request,
+    and keeps the result in the PROFILES ring buffer (see /admin/profiles).
+    cProfile sees the whole event-loop thread, so other requests running at the same
+    moment can show up in the CPU profile; the upstream spans are this request's only.
+    """
+    if PROFILE_LOCK["busy"] or not should_profile(request):
+        return await call_next(request)
+
+    PROFILE_LOCK["busy"] = True
+    ctx = {"t0": time.perf_counter(), "spans": [], "open": {}, "closed": False}
+    ctx_token = PROFILE_CONTEXT.set(ctx)
+    profiler = cProfile.Profile()
+    status_code = 500
+    try:
+        profiler.enable()
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        profiler.disable()
+        duration_ms = (time.perf_counter() - ctx["t0"]) * 1000
+        ctx["closed"] = True  # background tasks that inherited the context stop recording
+        PROFILE_CONTEXT.reset(ctx_token)
+        PROFILE_LOCK["busy"] = False
+        profiler.create_stats()
+        route = request.scope.get("route")
+        PROFILES.append({
+            "id": next(PROFILE_IDS),
+            "method": request.method,
+            "route": route.path if route is not None and hasattr(route, "path") else request.url.path,
+            "path": request.url.path,
+            "status": status_code,
+            "started_at": time.time() - duration_ms / 1000,
+            "duration_ms": round(duration_ms, 2),
+            "upstream_ms": round(sum(span["duration_ms"] for span in ctx["spans"]), 2),
+            "spans": list(ctx["spans"]),
+            "pstats": marshal.dumps(profiler.stats),  # same bytes pstats' dump_stats() writes
+        })
+
+
+if PROFILING_ENABLED:
+    app.middleware("http")(profile_request)
+
 
 # ✅ Add this for React Native / mobile access
+# Registered after the @app.middleware ones so it is the outermost layer: responses
+# produced inside them (e.g. 503/429 from admission_control) still get CORS headers.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # allow all origins for now
@@ -80,6 +557,34 @@ app.add_middleware(
 )
 
 
+def require_profile_admin(x_admin_token: str = Header(None)) -> None:
+    """Guards the /admin/profiles endpoints with PROFILE_TOKEN."""
+    if not PROFILE_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token, PROFILE_TOKEN):
+        raise HTTPException(status_code=403, detail="Not allowed")
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_profile_admin)])
+def list_profiles():
+    """Profiles in the ring buffer (newest first), with their upstream span timelines."""
+    return [{k: v for k, v in entry.items() if k != "pstats"} for entry in reversed(PROFILES)]
+
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_profile_admin)])
+def get_profile(profile_id: int):
+    """
+    The raw CPU profile in pstats format. Save it and open it with
+    `python -m pstats profile.prof`, snakeviz, or convert it for speedscope.
+    """
+    entry = next((e for e in PROFILES if e["id"] == profile_id), None)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Profile not found (it may have rotated out of the buffer)")
+    return Response(
+        content=entry["pstats"],
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.prof"'},
+    )
+
+
 def oauth_url(state: str) -> str:
     params = {
         "client_id": SPOTIFY_CLIENT_ID,
@@ -114,7 +619,7 @@ async def callback(request: Request, code: Optional[str] = None, state: Optional
     # ==== NO state/session validation here (dev/demo only) ====
 
     # Exchange code for tokens
-    async with httpx.AsyncClient() as client:
+    async with http_client() as client:
         data = {
             "grant_type": "authorization_code",
             "code": code,
@@ -170,7 +675,7 @@ async def check_and_refresh_token(session_data: dict) -> bool:
     if int(time.time()) >= int(session_data.get("expires_at", 0)):
         logger.info("Spotify token expired, refreshing...")
         try:
-            async with httpx.AsyncClient() as client:
+            async with http_client() as client:
                 data = {"grant_type": "refresh_token", "refresh_token": session_data.get("refresh_token")}
                 r = await client.post(TOKEN_URL, data=data, auth=(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET))
                 
@@ -186,7 +691,7 @@ async def check_and_refresh_token(session_data: dict) -> bool:
                 logger.info("Token refresh successful.")
                 return True
         except Exception as e:
-            logger.error(f"Token refresh failed: {e}")
+            logger.error("Token refresh failed: %s", e)
             # Could not refresh, the session is invalid
             return False
     return False  # No refresh was needed
@@ -232,6 +737,94 @@ async def get_current_mobile_session(authorization: str = Header(None)) -> dict:
     # Finally, return the valid (and possibly refreshed) session data
     return session_data
 
+
+# --- SERVER-SIDE RESPONSE CACHE ---
+def shared_http_client() -> httpx.AsyncClient:
+    """
+    The client shared (in-flight) fetches run on. No request owns it, so one that is
+    cancelled mid-fetch doesn't close it under the requests that joined the same fetch.
+    Connections belong to an event loop, so a new loop gets a new client.
+    """
+    loop = asyncio.get_running_loop()
+    if SHARED_CLIENT["client"] is None or SHARED_CLIENT["client"].is_closed or SHARED_CLIENT["loop"] is not loop:
+        SHARED_CLIENT.update(client=http_client(), loop=loop)
+    return SHARED_CLIENT["client"]
+
+
+def cache_user_key(session_data: dict) -> str:
+    """
+    Stable per-user key for the response cache. The access token rotates on every
+    refresh, so we prefer the Spotify user id (saved at login) and fall back to the refresh token.
+    """
+    return session_data.get("user_id") or session_data.get("refresh_token") or session_data.get("access_token")
+
+
+async def spotify_get_cached(session_data: dict, path: str, params: Optional[dict] = None) -> dict:
+    """
+    GETs `API_BASE + path` for this user, serving from RESPONSE_CACHE while the entry is fresh.
+    If the same request is already in flight (e.g. the login prefetch), we await that instead
+    of firing a duplicate upstream call. Raises httpx.HTTPStatusError like raise_for_status().
+    The fetch runs on shared_http_client(), so a caller that goes away can't break it for the others.
+    """
+    key = (cache_user_key(session_data), path, tuple(sorted((params or {}).items())))
+    used = CACHE_ENTRIES_USED.get()
+    entry = RESPONSE_CACHE.get(key)
+    if entry and entry["expires_at"] > time.time():
+        if used is not None:
+            used.append(entry)
+        return entry["data"]
+
+    inflight = INFLIGHT_FETCHES.get(key)
+    if inflight:
+        data = await asyncio.shield(inflight)
+        if used is not None and key in RESPONSE_CACHE:
+            used.append(RESPONSE_CACHE[key])
+        return data
+
+    async def fetch() -> dict:
+        note_upstream("spotify")
+        headers = {"Authorization": f"Bearer {session_data['access_token']}"}
+        response = await shared_http_client().get(f"{API_BASE}{path}", headers=headers, params=params)
+        response.raise_for_status()
+        data = response.json()
+        if len(RESPONSE_CACHE) >= RESPONSE_CACHE_MAX_ENTRIES:
+            # dicts keep insertion order, so this drops the oldest entry
+            RESPONSE_CACHE.pop(next(iter(RESPONSE_CACHE)), None)
+        RESPONSE_CACHE[key] = {"data": data, "expires_at": time.time() + RESPONSE_CACHE_TTL, "encoded": {}}
+        return data
+
+    task = asyncio.ensure_future(fetch())
+    INFLIGHT_FETCHES[key] = task
+    try:
+        data = await asyncio.shield(task)
+        if used is not None:
+            used.append(RESPONSE_CACHE[key])
+        return data
+    finally:
+        if task.done():
+            INFLIGHT_FETCHES.pop(key, None)
+        else:
+            task.add_done_callback(lambda _: INFLIGHT_FETCHES.pop(key, None))
+
+
+def clear_user_cache(user_key: str) -> None:
+    """Drops every cached response belonging to one user (used on logout)."""
+    for key in [k for k in RESPONSE_CACHE if k[0] == user_key]:
+        RESPONSE_CACHE.pop(key, None)
+
+
+def invalidate_playlist_cache(session_data: dict, playlist_id: Optional[str] = None) -> None:
+    """
+    Drops the user's cached /me/playlists pages (and that playlist's tracks, if given)
+    after we change something on Spotify, so the next read shows the new state.
+    """
+    user_key = cache_user_key(session_data)
+    stale_paths = {"/me/playlists"}
+    if playlist_id:
+        stale_paths.add(f"/playlists/{playlist_id}/tracks")
+    for key in [k for k in RESPONSE_CACHE if k[0] == user_key and k[1] in stale_paths]:
+        RESPONSE_CACHE.pop(key, None)
+
 @app.get("/logout")
 def logout(request: Request):
     request.session.clear()
@@ -246,18 +839,17 @@ async def get_user_profile_mobile(session_data: dict = Depends(get_current_mobil
     Fetches the current user's profile from Spotify.
     This route is now protected by our mobile auth dependency,
     which validates the Bearer token and handles refresh.
-    This is used by the mobile app to "validate" a stored session on startup.
+    This is used by the mobile app to "validate" a stored session on startup,
+    so a successful call also kicks off the background cache warm-up.
     """
-    access_token = session_data["access_token"]
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{API_BASE}/me", headers=headers)
-            response.raise_for_status()  # Let Spotify's error pass through
-            return response.json()
+        profile = await spotify_get_cached(session_data, "/me")  # Let Spotify's error pass through
+        session_data.setdefault("user_id", profile.get("id"))
+        schedule_prefetch(session_data)
+        schedule_ingestion(session_data)
+        return profile
     except httpx.HTTPStatusError as e:
-        logger.error(f"Spotify API error fetching /me: {e}")
+        logger.error("Spotify API error fetching /me: %s", e)
         raise HTTPException(status_code=e.response.status_code, detail=e.response.json())
     
 
@@ -270,7 +862,7 @@ async def get_artist(artist_id:str, request: Request):
     
     # Refresh access token if expired (same logic as /me)
     if int(time.time()) >= int(tokens.get("expires_at", 0)):
-        async with httpx.AsyncClient() as client:
+        async with http_client() as client:
             data = {
                 "grant_type": "refresh_token",
                 "refresh_token": tokens.get("refresh_token")
@@ -285,7 +877,7 @@ async def get_artist(artist_id:str, request: Request):
             tokens = new
 
     # Call Spotify artist endpoint
-    async with httpx.AsyncClient() as client:
+    async with http_client() as client:
         r = await client.get(
             f"{API_BASE}/artists/{artist_id}",
             headers={"Authorization": f"Bearer {tokens['access_token']}"}
@@ -294,6 +886,75 @@ async def get_artist(artist_id:str, request: Request):
             raise HTTPException(r.status_code, r.text)
         return r.json()
 
+# --- PER-USER BACKGROUND TASKS ---
+def start_user_task(registry: dict, user_key: str, coro) -> None:
+    """
+    Runs `coro` in the background as the user's task in `registry` (PREFETCH_TASKS,
+    INGEST_TASKS, ...), unless one is still running there. The task starts in an empty
+    contextvars.Context, so nothing set by the request that scheduled it (log context,
+    profiler, compression bookkeeping) leaks into it. Its registry entry goes when it ends.
+    """
+    running = registry.get(user_key)
+    if running and not running.done():
+        coro.close()  # never started, so nothing to clean up
+        return
+    # The task copies the context it is created in; create it inside a blank one
+    task = contextvars.Context().run(asyncio.ensure_future, coro)
+    registry[user_key] = task
+    task.add_done_callback(lambda t: registry.pop(user_key, None) if registry.get(user_key) is t else None)
+
+
+# --- POST-LOGIN CACHE WARM-UP ---
+async def prefetch_user_cache(session_data: dict) -> None:
+    """
+    Fetches what the first screens ask for (profile, top tracks/artists for every
+    time range, the first playlist page and the first few playlists' tracks) into
+    RESPONSE_CACHE, never running more than PREFETCH_CONCURRENCY upstream calls at once.
+    Uses the exact same path/params as the routes so their cache keys line up.
+    """
+    budget = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+    started = time.time()
+
+    async def warm(path: str, params: Optional[dict] = None):
+        async with budget:
+            try:
+                return await spotify_get_cached(session_data, path, params)
+            except httpx.HTTPError as e:
+                logger.warning("Prefetch of %s failed: %s", path, e)
+                return None
+
+    jobs = [warm("/me"), warm("/me/playlists", {"limit": 50})]
+    for type, fields in (("tracks", TOP_TRACKS_FIELDS), ("artists", TOP_ARTISTS_FIELDS)):
+        for time_range in TIME_RANGES:
+            jobs.append(warm(f"/me/top/{type}", {"limit": 50, "time_range": time_range, "fields": fields}))
+    results = await asyncio.gather(*jobs)
+
+    # Second wave: the tracks of the first few playlists on the list
+    playlists = results[1] or {}
+    playlist_ids = [p["id"] for p in playlists.get("items", []) if p and p.get("id")][:PREFETCH_PLAYLIST_TRACKS]
+    await asyncio.gather(*[
+        warm(f"/playlists/{pid}/tracks", {"limit": 100, "fields": PLAYLIST_TRACKS_FIELDS})
+        for pid in playlist_ids
+    ])
+
+    logger.info("Prefetch for %s finished in %.2fs", cache_user_key(session_data), time.time() - started)
+
+
+def schedule_prefetch(session_data: dict, profile: Optional[dict] = None) -> None:
+    """
+    Starts prefetch_user_cache in the background (fire-and-forget) unless it is
+    disabled or a warm-up for this user is already running. An already-fetched
+    profile can be passed in so we don't ask Spotify for it twice.
+    """
+    if not PREFETCH_ENABLED:
+        return
+    user_key = cache_user_key(session_data)
+    if profile is not None:
+        key = (user_key, "/me", ())
+        RESPONSE_CACHE[key] = {"data": profile, "expires_at": time.time() + RESPONSE_CACHE_TTL, "encoded": {}}
+    start_user_task(PREFETCH_TASKS, user_key, prefetch_user_cache(session_data))
+
+
 # --- DELETE your old @app.get("/auth/profile") ---
 # --- ADD this new version in its place ---
 
@@ -332,7 +993,7 @@ async def auth_profile_mobile(body: MobileAuthBody):
     access_token = spotify_tokens.get("access_token")
 
     # 2. Get profile from Spotify
-    async with httpx.AsyncClient() as client:
+    async with http_client() as client:
         r = await client.get(API_BASE + "/me", headers={"Authorization": f"Bearer {access_token}"})
         if r.status_code != 200:
             # Token might be bad or something else went wrong
@@ -345,7 +1006,13 @@ async def auth_profile_mobile(body: MobileAuthBody):
     # 4. Store the Spotify tokens (which we got from AUTH_CODES)
     #    in our new persistent mobile session store (AUTH_SESSIONS).
     AUTH_SESSIONS[mobile_session_token] = spotify_tokens
-    
+    spotify_tokens["user_id"] = profile_json.get("id")
+
+    # Warm the response cache in the background so Home and the top screens load locally
+    schedule_prefetch(spotify_tokens, profile=profile_json)
+    schedule_ingestion(spotify_tokens)
+    schedule_library_refresh(spotify_tokens)
+
     # 5. Return BOTH the profile AND our new session token
     return {
         "profile": profile_json,
@@ -359,18 +1026,11 @@ async def get_user_playlists(session_data: dict = Depends(get_current_mobile_ses
     Fetches the current user's (first 50) playlists from Spotify.
     This route is now protected by our new mobile auth dependency.
     """
-    access_token = session_data["access_token"]
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    api_url = f"{API_BASE}/me/playlists?limit=50"
-    
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(api_url, headers=headers)
-            response.raise_for_status()  # Let Spotify's error pass through if it fails
-            return response.json()
+        # Let Spotify's error pass through if it fails
+        return await spotify_get_cached(session_data, "/me/playlists", {"limit": 50})
     except httpx.HTTPStatusError as e:
-        logger.error(f"Spotify API error fetching playlists: {e}")
+        logger.error("Spotify API error fetching playlists: %s", e)
         raise HTTPException(status_code=e.response.status_code, detail=e.response.json())
 
 # --- ADD THIS NEW ENDPOINT to app_step3.py ---
@@ -381,23 +1041,643 @@ async def get_playlist_tracks(playlist_id: str, session_data: dict = Depends(get
     Fetches the tracks for a specific playlist from Spotify.
     Protected by our mobile 'Bearer <token>' dependency.
     """
-    access_token = session_data["access_token"]
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
     # We use the 'fields' param to ask Spotify for *only* the data we need.
     # This makes our app faster by reducing payload size.
-    fields = "items(track(id,name,album(images),artists(name)))"
-    api_url = f"{API_BASE}/playlists/{playlist_id}/tracks?limit=100&fields={fields}"
-    
+    params = {"limit": 100, "fields": PLAYLIST_TRACKS_FIELDS}
+
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(api_url, headers=headers)
-            response.raise_for_status()
-            return response.json()
+        return await spotify_get_cached(session_data, f"/playlists/{playlist_id}/tracks", params)
+    except httpx.HTTPStatusError as e:
+        logger.error("Spotify API error fetching playlist tracks: %s", e)
+        raise HTTPException(status_code=e.response.status_code, detail=e.response.json())
+
+# --- FULL-LIBRARY PAGINATION HELPERS ---
+async def spotify_get_all_pages(
+    client: httpx.AsyncClient, session_data: dict, path: str, params: dict, budget: asyncio.Semaphore, page_size: int
+) -> list:
+    """
+    Returns every item of a paginated Spotify collection. The first page tells us
+    `total`, then all remaining offsets are fetched concurrently (bounded by `budget`).
+    A page that gets 429 is retried (up to PAGINATION_MAX_RETRIES) after Retry-After.
+    Any `fields` mask in params must include `total`.
+    """
+    headers = {"Authorization": f"Bearer {session_data['access_token']}"}
+
+    async def page(offset: int) -> dict:
+        for attempt in range(PAGINATION_MAX_RETRIES + 1):
+            async with budget:
+                note_upstream("spotify")
+                response = await client.get(
+                    f"{API_BASE}{path}", headers=headers, params={**params, "limit": page_size, "offset": offset}
+                )
+            if response.status_code != 429 or attempt == PAGINATION_MAX_RETRIES:
+                break
+            try:
+                wait = float(response.headers.get("retry-after", "1"))
+            except ValueError:
+                wait = 1.0
+            # Wait outside the budget, so pages of other playlists aren't held up by this one
+            logger.warning("Spotify rate limit on %s, retrying in %.1fs", path, min(wait, PAGINATION_MAX_RETRY_WAIT))
+            await asyncio.sleep(min(wait, PAGINATION_MAX_RETRY_WAIT))
+        response.raise_for_status()
+        return response.json()
+
+    first = await page(0)
+    rest = await asyncio.gather(*[page(offset) for offset in range(page_size, first.get("total") or 0, page_size)])
+    items = list(first.get("items") or [])
+    for extra in rest:
+        items.extend(extra.get("items") or [])
+    return items
+
+
+async def get_playlist_track_ids(
+    client: httpx.AsyncClient, session_data: dict, playlist: dict, budget: asyncio.Semaphore
+) -> list:
+    """
+    All track ids of one playlist, in order (local files without an id are skipped).
+    Memoized on (playlist_id, snapshot_id), so unchanged playlists are never refetched.
+    """
+    key = (playlist["id"], playlist.get("snapshot_id"))
+    if key in PLAYLIST_TRACK_IDS:
+        return PLAYLIST_TRACK_IDS[key]
+
+    items = await spotify_get_all_pages(
+        client, session_data, f"/playlists/{playlist['id']}/tracks", {"fields": "items(track(id)),total"}, budget, 100
+    )
+    track_ids = [item["track"]["id"] for item in items if item and item.get("track") and item["track"].get("id")]
+    if key[1] is not None:
+        if len(PLAYLIST_TRACK_IDS) >= PLAYLIST_TRACK_IDS_MAX_ENTRIES:
+            PLAYLIST_TRACK_IDS.pop(next(iter(PLAYLIST_TRACK_IDS)), None)
+        PLAYLIST_TRACK_IDS[key] = track_ids
+    return track_ids
+
+
+def compute_playlist_overlap(track_lists: list) -> tuple:
+    """
+    Builds the playlist x track incidence matrix and its pairwise intersections.
+    Track ids are mapped to dense integers and each playlist row is packed into a
+    Python int used as a bitset, so one `a & b` + `bit_count()` intersects two rows
+    64 tracks per machine word (no numpy/scipy needed on the serverless bundle).
+    Returns (sizes, pairs, occurrences, track_ids): pairs is a list of (i, j, shared),
+    occurrences maps int track id -> playlist indexes (with repeats) and
+    track_ids maps int track id back to the Spotify id.
+    """
+    track_index = {}
+    occurrences = {}
+    encoded = []
+    for p_idx, track_ids in enumerate(track_lists):
+        ints = [track_index.setdefault(track_id, len(track_index)) for track_id in track_ids]
+        for t_idx in ints:
+            occurrences.setdefault(t_idx, []).append(p_idx)
+        encoded.append(ints)
+
+    # Pack each row once the universe is known: set bits in a bytearray, then one int.from_bytes
+    n_bytes = len(track_index) // 8 + 1
+    rows = []
+    for ints in encoded:
+        bits = bytearray(n_bytes)
+        for t_idx in ints:
+            bits[t_idx >> 3] |= 1 << (t_idx & 7)
+        rows.append(int.from_bytes(bits, "little"))
+
+    sizes = [row.bit_count() for row in rows]
+    pairs = []
+    for i, row_i in enumerate(rows):
+        if not row_i:
+            continue
+        # one row against every later row in a single comprehension
+        shared_counts = [(row_i & row_j).bit_count() for row_j in rows[i + 1:]]
+        pairs.extend((i, i + 1 + k, shared) for k, shared in enumerate(shared_counts) if shared)
+    return sizes, pairs, occurrences, list(track_index)
+
+
+def build_overlap_report(playlists: list, track_lists: list, min_shared: int, limit: int) -> dict:
+    """
+    The CPU-heavy part of /playlists/overlap (pairwise pass + result rows), kept
+    synchronous so the route can run it in a worker thread.
+    """
+    sizes, pairs, occurrences, track_ids = compute_playlist_overlap(track_lists)
+
+    pair_rows = []
+    for i, j, shared in pairs:
+        if shared < min_shared:
+            continue
+        pair_rows.append({
+            "a": playlists[i]["id"],
+            "b": playlists[j]["id"],
+            "shared": shared,
+            "jaccard": round(shared / (sizes[i] + sizes[j] - shared), 4),
+            "overlap": round(shared / min(sizes[i], sizes[j]), 4),
+        })
+    pair_rows.sort(key=lambda row: (row["jaccard"], row["shared"]), reverse=True)
+
+    duplicates = [
+        {
+            "track_id": track_ids[t_idx],
+            "playlists": sorted({playlists[p_idx]["id"] for p_idx in p_idxs}),
+            "occurrences": len(p_idxs),
+        }
+        for t_idx, p_idxs in occurrences.items()
+        if len(p_idxs) > 1
+    ]
+    duplicates.sort(key=lambda row: row["occurrences"], reverse=True)
+
+    return {
+        "playlists": [
+            {"id": p["id"], "name": p.get("name"), "unique_tracks": size, "tracks": len(track_list)}
+            for p, size, track_list in zip(playlists, sizes, track_lists)
+        ],
+        "pairs": pair_rows[:limit],
+        "duplicates": duplicates[:limit],
+        "stats": {
+            "playlists": len(playlists),
+            "unique_tracks": len(track_ids),
+            "entries": sum(len(t) for t in track_lists),
+            "overlapping_pairs": len(pair_rows),
+            "duplicated_tracks": len(duplicates),
+        },
+    }
+
+
+@app.get("/playlists/overlap")
+async def get_playlists_overlap(
+    min_shared: int = 1,
+    limit: int = 200,
+    session_data: dict = Depends(get_current_mobile_session)
+    ):
+    """
+    Pairwise overlap across ALL of the user's playlists, plus the tracks that show up
+    more than once (in several playlists, or twice in the same one).
+    Playlists and their track pages are loaded concurrently; unchanged playlists
+    (same snapshot_id) come from memory. `limit` caps both `pairs` and `duplicates`.
+    Playlists whose tracks can't be read are left out and listed under `unavailable`.
+    """
+    if limit < 0:
+        raise HTTPException(status_code=400, detail="Invalid limit. Must be 0 or more.")
+
+    budget = asyncio.Semaphore(PAGINATION_CONCURRENCY)
+    try:
+        async with http_client() as client:
+            playlists = await spotify_get_all_pages(client, session_data, "/me/playlists", {}, budget, 50)
+            playlists = [p for p in playlists if p and p.get("id")]
+            results = await asyncio.gather(*[
+                get_playlist_track_ids(client, session_data, p, budget) for p in playlists
+            ], return_exceptions=True)
     except httpx.HTTPStatusError as e:
-        logger.error(f"Spotify API error fetching playlist tracks: {e}")
+        logger.error("Spotify API error fetching playlists for overlap: %s", e)
         raise HTTPException(status_code=e.response.status_code, detail=e.response.json())
 
+    # With hundreds of playlists some are bound to fail (unavailable, Spotify-owned, rate
+    # limited); compute the overlap over the rest instead of failing the whole request
+    readable, track_lists, unavailable = [], [], []
+    for playlist, result in zip(playlists, results):
+        if isinstance(result, httpx.HTTPError):
+            logger.warning("Skipping playlist %s in overlap: %s", playlist["id"], result)
+            status = result.response.status_code if isinstance(result, httpx.HTTPStatusError) else None
+            unavailable.append({"id": playlist["id"], "name": playlist.get("name"), "status": status})
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            readable.append(playlist)
+            track_lists.append(result)
+
+    # Hundreds of playlists make this a noticeable CPU burst; keep it off the event loop
+    report = await asyncio.to_thread(build_overlap_report, readable, track_lists, min_shared, limit)
+    report["unavailable"] = unavailable
+    return report
+
+
+# --- RECENTLY-PLAYED INGESTION ---
+def get_play_log(user_key: str) -> dict:
+    """
+    The compact per-user play log. Track ids are interned to small ints, and plays are
+    two parallel arrays (track int, played_at in epoch ms), appended in time order.
+    `cursor` is the played_at of the newest play we have, i.e. the next `after` value.
+    """
+    log = PLAY_LOGS.get(user_key)
+    if log is None:
+        log = {
+            "track_ids": array("I"),
+            "played_at": array("q"),
+            "track_index": {},   # spotify track id -> int
+            "tracks": [],        # int -> spotify track id
+            "cursor": 0,
+            "last_ingest": 0.0,
+            "lock": asyncio.Lock(),
+        }
+        PLAY_LOGS[user_key] = log
+    return log
+
+
+async def ingest_recently_played(client: httpx.AsyncClient, session_data: dict) -> int:
+    """
+    Fetches only the plays newer than the log's cursor and appends them. Idempotent:
+    anything at or before the cursor is dropped, and runs for one user are serialized
+    by the log's lock, so overlapping runs can't double-append. Returns how many plays were added.
+    """
+    log = get_play_log(cache_user_key(session_data))
+    async with log["lock"]:
+        await check_and_refresh_token(session_data)
+        headers = {"Authorization": f"Bearer {session_data['access_token']}"}
+        added = 0
+        for _ in range(RECENTLY_PLAYED_MAX_PAGES):
+            params = {"limit": 50}
+            if log["cursor"]:
+                params["after"] = log["cursor"]
+            response = await client.get(f"{API_BASE}/me/player/recently-played", headers=headers, params=params)
+            response.raise_for_status()
+            items = response.json().get("items") or []
+
+            plays = []
+            for item in items:
+                track = item.get("track") or {}
+                if not track.get("id") or not item.get("played_at"):
+                    continue
+                # round(), not int(): float seconds * 1000 can land just below the exact ms
+                played_at = round(datetime.datetime.fromisoformat(item["played_at"].replace("Z", "+00:00")).timestamp() * 1000)
+                if played_at > log["cursor"]:
+                    plays.append((played_at, track["id"]))
+            plays.sort()
+
+            for played_at, track_id in plays:
+                if played_at <= log["cursor"]:
+                    continue  # same timestamp twice in one page
+                t_idx = log["track_index"].get(track_id)
+                if t_idx is None:
+                    t_idx = log["track_index"][track_id] = len(log["tracks"])
+                    log["tracks"].append(track_id)
+                log["track_ids"].append(t_idx)
+                log["played_at"].append(played_at)
+                log["cursor"] = played_at
+                added += 1
+
+            # A full page right after the cursor means there may be more to catch up on
+            if len(items) < 50 or not plays:
+                break
+
+        log["last_ingest"] = time.time()
+        return added
+
+
+async def ingestion_loop(session_data: dict) -> None:
+    """Polls recently-played for one session until it is logged out."""
+    async with http_client() as client:
+        while any(s is session_data for s in AUTH_SESSIONS.values()):
+            try:
+                added = await ingest_recently_played(client, session_data)
+                logger.info("Ingested %d new plays for %s", added, cache_user_key(session_data))
+            except httpx.HTTPError as e:
+                logger.warning("Recently-played ingestion failed: %s", e)
+            except Exception as e:
+                # A bad payload or a failed refresh must not end the loop for good
+                logger.exception("Unexpected error during recently-played ingestion: %s", e)
+            await asyncio.sleep(RECENTLY_PLAYED_POLL_INTERVAL)
+
+
+def stop_ingestion(session_data: dict) -> None:
+    """
+    Cancels the user's ingestion loop when a session logs out. If the user still
+    has another session, a new loop is started under that one.
+    """
+    user_key = cache_user_key(session_data)
+    task = INGEST_TASKS.pop(user_key, None)
+    if task is None:
+        return
+    task.cancel()
+    other = next((s for s in AUTH_SESSIONS.values() if cache_user_key(s) == user_key), None)
+    if other is not None:
+        schedule_ingestion(other)
+
+
+def schedule_ingestion(session_data: dict) -> None:
+    """Starts the per-session ingestion loop unless one is already running for this user."""
+    start_user_task(INGEST_TASKS, cache_user_key(session_data), ingestion_loop(session_data))
+
+
+@app.get("/me/history")
+async def get_listening_history(
+    bucket: str = "day",
+    days: int = 30,
+    track_id: Optional[str] = None,
+    session_data: dict = Depends(get_current_mobile_session)
+    ):
+    """
+    Play counts per hour/day/week from our local play log (no Spotify call on this path).
+    History starts at the user's first ingestion, since Spotify only keeps the last 50 plays.
+    """
+    if bucket not in HISTORY_BUCKETS:
+        raise HTTPException(status_code=400, detail="Invalid bucket. Must be 'hour', 'day' or 'week'.")
+
+    schedule_ingestion(session_data)
+    log = get_play_log(cache_user_key(session_data))
+    size = HISTORY_BUCKETS[bucket]
+    # 1970-01-01 was a Thursday; shift week buckets so they start on Monday
+    shift = 3 * HISTORY_BUCKETS["day"] if bucket == "week" else 0
+    since = int((time.time() - days * 24 * 3600) * 1000)
+    wanted = log["track_index"].get(track_id) if track_id else None
+    if track_id and wanted is None:
+        return {"bucket": bucket, "total": 0, "buckets": [], "last_ingest": log["last_ingest"] or None}
+
+    counts = {}
+    first = bisect.bisect_left(log["played_at"], since)  # the log is in time order
+    for i in range(first, len(log["played_at"])):
+        if wanted is not None and log["track_ids"][i] != wanted:
+            continue
+        played_at = log["played_at"][i]
+        start = played_at - (played_at + shift) % size
+        counts[start] = counts.get(start, 0) + 1
+
+    buckets = [
+        {"start": datetime.datetime.fromtimestamp(start / 1000, tz=datetime.timezone.utc).isoformat(), "plays": plays}
+        for start, plays in sorted(counts.items())
+    ]
+    return {
+        "bucket": bucket,
+        "total": sum(counts.values()),
+        "buckets": buckets,
+        "last_ingest": log["last_ingest"] or None,
+    }
+
+
+# --- LIBRARY SEARCH INDEX ---
+def get_library_index(user_key: str) -> dict:
+    """
+    One user's searchable library, stored column-wise: track i has ids[i], names[i], ...
+    Tracks are only ever appended; `alive` masks out tracks no longer in any source,
+    so refreshes never renumber anything and posting lists stay valid.
+    `postings` maps a search key to an array of track ints: "^a"/"^ab" for the first
+    one/two letters of a word (short queries) and every 3-letter n-gram of a word.
+    """
+    index = LIBRARY_INDEXES.get(user_key)
+    if index is None:
+        index = {
+            "ids": [], "names": [], "artists": [], "albums": [], "images": [],
+            "name_text": [],    # normalized track name (ranking)
+            "search_text": [],  # normalized name + artists + album (verifying candidates)
+            "sources": [],      # per track: set of playlist ids and/or LIBRARY_SAVED_SOURCE
+            "alive": bytearray(),
+            "track_index": {},  # spotify track id -> int
+            "postings": {},
+            "playlists": {},    # playlist id -> {"snapshot_id", "name", "tracks": [int, ...]}
+            "saved": {"marker": None, "tracks": []},
+            "built_at": 0.0,
+            "retry_at": 0.0,    # no refresh before this (set after a failed one)
+            "lock": asyncio.Lock(),
+        }
+        LIBRARY_INDEXES[user_key] = index
+    return index
+
+
+def normalize_search_text(text: str) -> str:
+    """Lowercase, accents stripped, punctuation turned into spaces: 'Beyoncé - Halo!' -> 'beyonce halo'."""
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    return " ".join("".join(ch if ch.isalnum() else " " for ch in text if not unicodedata.combining(ch)).split())
+
+
+def search_keys(word: str) -> set:
+    keys = {"^" + word[:1], "^" + word[:2]}
+    keys.update(word[i:i + 3] for i in range(len(word) - 2))
+    return keys
+
+
+def index_track(index: dict, track: dict, source: str) -> Optional[int]:
+    """Adds `source` to a track's sources, appending the track (and its postings) if it is new."""
+    track_id = track.get("id")
+    if not track_id:
+        return None  # local files have no id
+    t_idx = index["track_index"].get(track_id)
+    if t_idx is None:
+        t_idx = index["track_index"][track_id] = len(index["ids"])
+        artists = ", ".join(a.get("name", "") for a in track.get("artists") or [] if a)
+        album = track.get("album") or {}
+        images = album.get("images") or []
+        name_text = normalize_search_text(track.get("name"))
+        search_text = f"{name_text} {normalize_search_text(artists)} {normalize_search_text(album.get('name'))}"
+        index["ids"].append(track_id)
+        index["names"].append(track.get("name"))
+        index["artists"].append(artists)
+        index["albums"].append(album.get("name"))
+        index["images"].append(images[-1]["url"] if images else None)  # smallest image
+        index["name_text"].append(name_text)
+        index["search_text"].append(search_text)
+        index["sources"].append(set())
+        index["alive"].append(0)
+        keys = set()
+        for word in search_text.split():
+            keys |= search_keys(word)
+        for key in keys:
+            posting = index["postings"].get(key)
+            if posting is None:
+                posting = index["postings"][key] = array("I")
+            posting.append(t_idx)
+    index["sources"][t_idx].add(source)
+    index["alive"][t_idx] = 1
+    return t_idx
+
+
+def unindex_source(index: dict, source: str, track_ints: list) -> None:
+    """Removes `source` from these tracks; tracks left without any source stop matching."""
+    for t_idx in track_ints:
+        sources = index["sources"][t_idx]
+        sources.discard(source)
+        if not sources:
+            index["alive"][t_idx] = 0
+
+
+async def index_items_chunked(index: dict, items: list, source: str) -> list:
+    """
+    index_track() for every playlist/saved item, LIBRARY_INDEX_CHUNK at a time with an
+    `await asyncio.sleep(0)` in between, so other requests keep being served meanwhile.
+    Returns the track ints in order (items without a track id are skipped).
+    """
+    track_ints = []
+    for start in range(0, len(items), LIBRARY_INDEX_CHUNK):
+        for item in items[start:start + LIBRARY_INDEX_CHUNK]:
+            if item and item.get("track"):
+                t_idx = index_track(index, item["track"], source)
+                if t_idx is not None:
+                    track_ints.append(t_idx)
+        await asyncio.sleep(0)
+    return track_ints
+
+
+async def refresh_library_index(session_data: dict) -> None:
+    """
+    Brings the user's index up to date. Only playlists whose snapshot_id changed (or that
+    are new) have their tracks refetched; deleted playlists are detached. Saved tracks have
+    no snapshot_id, so we compare (total, newest added_at) from a 1-item page instead.
+    Indexing a big library is seconds of CPU, so it is done in chunks that yield to the
+    event loop (see index_items_chunked). A search in between may briefly see a track
+    under both its old and new sources, but never misses one that is in both.
+    A playlist (or the saved tracks) that fails to load keeps its old entry and snapshot,
+    so it is fetched again by the next refresh; the other sources are still applied.
+    """
+    index = get_library_index(cache_user_key(session_data))
+    async with index["lock"]:
+        await check_and_refresh_token(session_data)
+        budget = asyncio.Semaphore(PAGINATION_CONCURRENCY)
+        async with http_client() as client:
+            playlists = await spotify_get_all_pages(client, session_data, "/me/playlists", {}, budget, 50)
+            current = {p["id"]: p for p in playlists if p and p.get("id")}
+            changed = [
+                p for pid, p in current.items()
+                if pid not in index["playlists"] or index["playlists"][pid]["snapshot_id"] != p.get("snapshot_id")
+            ]
+
+            saved_marker = index["saved"]["marker"]
+            try:
+                headers = {"Authorization": f"Bearer {session_data['access_token']}"}
+                response = await client.get(f"{API_BASE}/me/tracks", headers=headers, params={"limit": 1})
+                response.raise_for_status()
+                newest = response.json()
+                items = newest.get("items") or []
+                saved_marker = (newest.get("total"), items[0].get("added_at") if items else None)
+            except httpx.HTTPStatusError as e:
+                logger.warning("Skipping saved tracks in library index: %s", e)
+
+            async def playlist_items(playlist: dict) -> list:
+                return await spotify_get_all_pages(
+                    client, session_data, f"/playlists/{playlist['id']}/tracks", {"fields": LIBRARY_TRACK_FIELDS}, budget, 100
+                )
+
+            jobs = [playlist_items(p) for p in changed]
+            refetch_saved = saved_marker != index["saved"]["marker"]
+            if refetch_saved:
+                jobs.append(spotify_get_all_pages(client, session_data, "/me/tracks", {}, budget, 50))
+            results = await asyncio.gather(*jobs, return_exceptions=True)
+
+        failed = 0
+        for source, result in zip([p["id"] for p in changed] + [LIBRARY_SAVED_SOURCE], results):
+            if isinstance(result, httpx.HTTPError):
+                logger.warning("Skipping %s in library index until the next refresh: %s", source, result)
+                failed += 1
+            elif isinstance(result, BaseException):
+                raise result
+
+        for pid in [pid for pid in index["playlists"] if pid not in current]:
+            unindex_source(index, pid, index["playlists"].pop(pid)["tracks"])
+        for playlist, items in zip(changed, results):
+            if isinstance(items, BaseException):
+                continue  # old entry (if any) stays, with its old snapshot_id
+            track_ints = await index_items_chunked(index, items, playlist["id"])
+            old = index["playlists"].get(playlist["id"])
+            if old:
+                unindex_source(index, playlist["id"], set(old["tracks"]).difference(track_ints))
+            index["playlists"][playlist["id"]] = {
+                "snapshot_id": playlist.get("snapshot_id"),
+                "name": playlist.get("name"),
+                "tracks": track_ints,
+            }
+        if refetch_saved and not isinstance(results[-1], BaseException):
+            track_ints = await index_items_chunked(index, results[-1], LIBRARY_SAVED_SOURCE)
+            unindex_source(index, LIBRARY_SAVED_SOURCE, set(index["saved"]["tracks"]).difference(track_ints))
+            index["saved"] = {"marker": saved_marker, "tracks": track_ints}
+
+        index["built_at"] = time.time()
+        logger.info(
+            "Library index refreshed: %d playlists changed, saved refetched=%s, %d sources failed, %d tracks",
+            len(changed), refetch_saved, failed, len(index["ids"]),
+        )
+
+
+def schedule_library_refresh(session_data: dict) -> None:
+    """Starts a background refresh of the user's library index unless one is already running."""
+    async def run():
+        try:
+            await refresh_library_index(session_data)
+        except httpx.HTTPError as e:
+            # e.g. /me/playlists itself failed; back off so every search doesn't start a new crawl
+            logger.warning("Library index refresh failed, retrying in %ds at the earliest: %s", LIBRARY_REFRESH_BACKOFF, e)
+            get_library_index(cache_user_key(session_data))["retry_at"] = time.time() + LIBRARY_REFRESH_BACKOFF
+
+    start_user_task(LIBRARY_TASKS, cache_user_key(session_data), run())
+
+
+def search_library_index(index: dict, query: str, limit: int) -> list:
+    """
+    Every query word must match: words of 1-2 letters as word prefixes, longer ones via
+    their trigrams. Candidates come from intersecting posting lists (smallest first).
+    Postings are exact for words of up to 3 letters; longer words get checked against
+    the full text, since their trigrams could come from different words.
+    """
+    tokens = normalize_search_text(query).split()
+    if not tokens:
+        return []
+    postings = []
+    for token in tokens:
+        keys = ["^" + token] if len(token) <= 2 else [token[i:i + 3] for i in range(len(token) - 2)]
+        for key in keys:
+            posting = index["postings"].get(key)
+            if posting is None:
+                return []
+            postings.append(posting)
+    postings.sort(key=len)
+    candidates = set(postings[0])
+    for posting in postings[1:]:
+        candidates.intersection_update(posting)
+        if not candidates:
+            return []
+
+    alive, search_text, name_text = index["alive"], index["search_text"], index["name_text"]
+    matches = [t_idx for t_idx in candidates if alive[t_idx]]
+    for token in tokens:
+        if len(token) > 3:
+            matches = [t_idx for t_idx in matches if token in search_text[t_idx]]
+
+    phrase = " ".join(tokens)
+
+    def rank(t_idx: int) -> tuple:
+        # Title starting with the query first, then titles containing it, then the rest; shorter first
+        name = name_text[t_idx]
+        return (0 if name.startswith(phrase) else 1 if phrase in name else 2, len(name))
+
+    return heapq.nsmallest(limit, matches, key=rank)
+
+
+@app.get("/search/library")
+async def search_library(
+    q: str,
+    limit: int = 20,
+    session_data: dict = Depends(get_current_mobile_session)
+    ):
+    """
+    Instant search across all of the user's playlists and saved tracks, served from the
+    in-memory index. A stale or missing index is refreshed in the background (not again
+    within LIBRARY_REFRESH_BACKOFF of a failed refresh); results come from whatever is
+    indexed right now (`building` tells the app more is coming).
+    """
+    started = time.perf_counter()
+    index = get_library_index(cache_user_key(session_data))
+    building = False
+    now = time.time()
+    if now - index["built_at"] > LIBRARY_REFRESH_INTERVAL and now >= index["retry_at"]:
+        schedule_library_refresh(session_data)
+        building = True
+
+    results = []
+    for t_idx in search_library_index(index, q, max(1, min(limit, 100))):
+        sources = index["sources"][t_idx]
+        results.append({
+            "id": index["ids"][t_idx],
+            "name": index["names"][t_idx],
+            "artists": index["artists"][t_idx],
+            "album": index["albums"][t_idx],
+            "image": index["images"][t_idx],
+            "saved": LIBRARY_SAVED_SOURCE in sources,
+            "playlists": [
+                {"id": pid, "name": index["playlists"][pid]["name"]}
+                for pid in sources if pid in index["playlists"]
+            ],
+        })
+    return {
+        "query": q,
+        "results": results,
+        "indexed_tracks": len(index["ids"]),
+        "building": building or index["lock"].locked(),
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
 # --- ADD this new mobile logout endpoint ---
 
 @app.post("/auth/logout")
@@ -416,18 +1696,97 @@ async def auth_logout_mobile(authorization: str = Header(None)):
         popped_session = AUTH_SESSIONS.pop(token, None)
         
         if popped_session:
-            logger.info(f"Invalidated session for token starting with: {token[:6]}...")
+            clear_user_cache(cache_user_key(popped_session))
+            stop_ingestion(popped_session)
+            logger.info("Invalidated session for token starting with: %s...", token[:6])
         else:
-            logger.warning(f"Logout attempt for unknown token starting with: {token[:6]}...")
+            logger.warning("Logout attempt for unknown token starting with: %s...", token[:6])
 
         return {"status": "logged_out"}
 
     except Exception as e:
-        logger.error(f"Error during mobile logout: {e}")
+        logger.error("Error during mobile logout: %s", e)
         # Fail gracefully
         raise HTTPException(status_code=400, detail="Invalid authorization header for logout")
     
 
+# ALL TOP ITEMS IN ONE CALL
+def normalize_nested_artists(entity: dict, artists: dict) -> None:
+    """
+    Replaces entity["artists"] with entity["artist_ids"] (adding unseen artists to the
+    table) when every nested artist has an id. Otherwise the list stays inline as-is,
+    e.g. when a fields mask like artists(name) left the ids out.
+    """
+    nested = entity.get("artists")
+    if not nested or not all(artist and artist.get("id") for artist in nested):
+        return
+    for artist in nested:
+        artists.setdefault(artist["id"], artist)
+    entity["artist_ids"] = [artist["id"] for artist in entity.pop("artists")]
+
+
+def normalize_top_items(range_payloads: dict) -> dict:
+    """
+    Turns {(type, time_range): spotify_response} into entity tables keyed by id plus
+    ranked id lists per range. Each track/artist/album appears once no matter how many
+    ranges it shows up in; nested objects that have ids are replaced by them (album_id,
+    artist_ids), nested objects without ids stay inline so nothing is lost.
+    Full artist objects from /me/top/artists win over the simplified ones inside tracks.
+    """
+    tracks, artists, albums = {}, {}, {}
+    ranges = {time_range: {"tracks": [], "artists": []} for time_range in TIME_RANGES}
+
+    for (type, time_range), payload in range_payloads.items():
+        for item in payload.get("items") or []:
+            if not item or not item.get("id"):
+                continue
+            ranges[time_range][type].append(item["id"])
+            if type == "artists":
+                artists[item["id"]] = item
+                continue
+            if item["id"] in tracks:
+                continue
+            track = dict(item)
+            normalize_nested_artists(track, artists)
+            album = track.get("album")
+            if album and album.get("id"):
+                if album["id"] not in albums:
+                    album = dict(album)
+                    normalize_nested_artists(album, artists)
+                    albums[album["id"]] = album
+                del track["album"]
+                track["album_id"] = album["id"]
+            tracks[item["id"]] = track
+
+    return {"tracks": tracks, "artists": artists, "albums": albums, "ranges": ranges}
+
+
+@app.get("/me/top/all")
+async def get_top_all(session_data: dict = Depends(get_current_mobile_session)):
+    """
+    Top tracks AND artists for all three time ranges in one response: entity tables
+    (tracks/artists/albums by id) plus per-range ranked id lists, so an entity that
+    recurs across ranges is sent and serialized once. Uses the same upstream calls
+    (and cache entries) as /me/top/{type}, fetched concurrently.
+    NOTE: declared before /me/top/{type} so 'all' isn't taken as a type.
+    """
+    keys = [(type, time_range) for type in ("tracks", "artists") for time_range in TIME_RANGES]
+    try:
+        payloads = await asyncio.gather(*[
+            spotify_get_cached(session_data, f"/me/top/{type}", {
+                "limit": 50,
+                "time_range": time_range,
+                "fields": TOP_TRACKS_FIELDS if type == "tracks" else TOP_ARTISTS_FIELDS,
+            })
+            for type, time_range in keys
+        ])
+    except httpx.HTTPStatusError as e:
+        logger.error("Spotify API error fetching /me/top/all: %s", e)
+        raise HTTPException(status_code=e.response.status_code, detail=e.response.json())
+
+    return normalize_top_items(dict(zip(keys, payloads)))
+
+
 # TOP TRACKS/ARTISTS
 @app.get("/me/top/{type}")
 async def get_top_stats(
@@ -439,9 +1798,6 @@ async def get_top_stats(
     if type not in ["artists", "tracks"]:
         raise HTTPException(status_code=400, detail="Invalid type. Must be 'artists' or 'tracks'.")
     
-    access_token = session_data["access_token"]
-    headers = {"Authorization": f"Bearer {access_token}"}
-
     # 3. Dynamically choose the correct fields mask
     fields = TOP_TRACKS_FIELDS if type == "tracks" else TOP_ARTISTS_FIELDS
 
@@ -452,15 +1808,11 @@ async def get_top_stats(
         "fields": fields
     }
 
-    api_url = f"{API_BASE}/me/top/{type}"
-
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(api_url, headers=headers, params=params)
-            response.raise_for_status()
-            return response.json()
+        # Usually a cache hit right after login, thanks to the prefetch
+        return await spotify_get_cached(session_data, f"/me/top/{type}", params)
     except httpx.HTTPStatusError as e:
-        logger.error(f"Spotify API error fetching /me/top/{type}: {e}")
+        logger.error("Spotify API error fetching /me/top/%s: %s", type, e)
         raise HTTPException(status_code=e.response.status_code, detail=e.response.json())
 
 @app.get("/currently-playing")
@@ -476,7 +1828,7 @@ async def get_currently_playing(session_data: dict = Depends(get_current_mobile_
     api_url = f"{API_BASE}/me/player/currently-playing?market=US"
     
     try:
-        async with httpx.AsyncClient() as client:
+        async with http_client() as client:
             response = await client.get(api_url, headers=headers)
 
             # --- SPECIAL HANDLING ---
@@ -491,7 +1843,7 @@ async def get_currently_playing(session_data: dict = Depends(get_current_mobile_
             return response.json()
             
     except httpx.HTTPStatusError as e:
-        logger.error(f"Spotify API error fetching currently-playing: {e}")
+        logger.error("Spotify API error fetching currently-playing: %s", e)
         raise HTTPException(status_code=e.response.status_code, detail=e.response.json())
     
 
@@ -505,7 +1857,7 @@ async def create_forgotten_gems_playlist(session_data: dict = Depends(get_curren
     headers = {"Authorization": f"Bearer {access_token}"}
     
     try:
-        async with httpx.AsyncClient() as client:
+        async with http_client() as client:
             # 1. Get Top 50 All-Time (long_term)
             long_term_resp = await client.get(
                 f"{API_BASE}/me/top/tracks?time_range=long_term&limit=50", headers=headers
@@ -550,11 +1902,12 @@ async def create_forgotten_gems_playlist(session_data: dict = Depends(get_curren
             await client.post(
                 f"{API_BASE}/playlists/{new_playlist_id}/tracks", headers=headers, json={"uris": gem_track_uris}
             )
-            
+            invalidate_playlist_cache(session_data)  # so /playlists lists the new one right away
+
             return new_playlist
 
     except httpx.HTTPStatusError as e:
-        logger.error(f"Spotify API error creating forgotten gems: {e.response.text}")
+        logger.error("Spotify API error creating forgotten gems: %s", truncate_payload(e.response.text))
         raise HTTPException(status_code=e.response.status_code, detail=e.response.json())
 
 @app.get("/me/ai-analysis")
@@ -574,7 +1927,7 @@ async def get_ai_analysis(session_data: dict = Depends(get_current_mobile_sessio
 
     try:
         # 1. Fetch Spotify data concurrently
-        async with httpx.AsyncClient() as client:
+        async with http_client() as client:
             artist_task = client.get(f"{API_BASE}/me/top/artists?limit=5&time_range=medium_term", headers=headers_spotify)
             track_task = client.get(f"{API_BASE}/me/top/tracks?limit=10&time_range=medium_term", headers=headers_spotify)
             artist_resp, track_resp = await asyncio.gather(artist_task, track_task)
@@ -610,6 +1963,7 @@ async def get_ai_analysis(session_data: dict = Depends(get_current_mobile_sessio
                 "messages": [{"role": "user", "content": prompt}],
             }
             logger.info("Sending request...")
+            note_upstream("openrouter")
             response_ai = await client.post(
                 "https://openrouter.ai/api/v1/chat/completions",
                 headers=headers_openrouter,
@@ -618,7 +1972,7 @@ async def get_ai_analysis(session_data: dict = Depends(get_current_mobile_sessio
             )
             # helpful debug logging before raising
             logger.info("OpenRouter status: %s", response_ai.status_code)
-            logger.info("OpenRouter body: %s", response_ai.text)
+            log_payload("OpenRouter body", response_ai.text)  # sampled + size-capped, these can be large
             response_ai.raise_for_status()
             
             ai_text = response_ai.json()["choices"][0]["message"]["content"].strip()
@@ -631,13 +1985,13 @@ async def get_ai_analysis(session_data: dict = Depends(get_current_mobile_sessio
             return {"analysis": ai_text}
 
     except httpx.HTTPStatusError as e:
-        logger.error(f"API error during AI analysis: {e.response.text}")
+        logger.error("API error during AI analysis: %s", truncate_payload(e.response.text))
         if "openrouter" in str(e.request.url):
             raise HTTPException(status_code=502, detail="AI provider error.")
         else:
             raise HTTPException(status_code=e.response.status_code, detail="Could not fetch Spotify data.")
     except Exception as e:
-        logger.exception(f"Unhandled error during AI analysis: {e}")
+        logger.exception("Unhandled error during AI analysis: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error during AI analysis.")
 
 
@@ -652,12 +2006,12 @@ async def get_playlist_details(playlist_id: str, session_data: dict = Depends(ge
     api_url = f"{API_BASE}/playlists/{playlist_id}"
     
     try:
-        async with httpx.AsyncClient() as client:
+        async with http_client() as client:
             response = await client.get(api_url, headers=headers)
             response.raise_for_status()
             return response.json()
     except httpx.HTTPStatusError as e:
-        logger.error(f"Spotify API error fetching playlist details: {e.response.text}")
+        logger.error("Spotify API error fetching playlist details: %s", truncate_payload(e.response.text))
         raise HTTPException(status_code=e.response.status_code, detail=e.response.json())
 
 # ENDPOINT 2: Generate and save AI description
@@ -674,7 +2028,7 @@ async def generate_ai_description(playlist_id: str, session_data: dict = Depends
         raise HTTPException(status_code=500, detail="AI service is not configured.")
 
     try:
-        async with httpx.AsyncClient() as client:
+        async with http_client() as client:
             # 1. Get first 15 tracks from the playlist for context
             tracks_resp = await client.get(f"{API_BASE}/playlists/{playlist_id}/tracks?limit=15", headers=headers_spotify)
             tracks_resp.raise_for_status()
@@ -685,6 +2039,7 @@ async def generate_ai_description(playlist_id: str, session_data: dict = Depends
             
             headers_openrouter = {"Authorization": f"Bearer {openrouter_key}"}
             payload = {"model": "deepseek/deepseek-chat-v3.1:free", "messages": [{"role": "user", "content": prompt}]}
+            note_upstream("openrouter")
             response_ai = await client.post("https://openrouter.ai/api/v1/chat/completions", headers=headers_openrouter, json=payload, timeout=30.0)
             response_ai.raise_for_status()
             ai_description = response_ai.json()["choices"][0]["message"]["content"].strip()
@@ -696,12 +2051,13 @@ async def generate_ai_description(playlist_id: str, session_data: dict = Depends
             # 3. Save the new description back to Spotify
             update_payload = {"description": ai_description}
             await client.put(f"{API_BASE}/playlists/{playlist_id}", headers=headers_spotify, json=update_payload)
+            invalidate_playlist_cache(session_data, playlist_id)
             
             # 4. Return the new description to the app
             return {"description": ai_description}
 
     except Exception as e:
-        logger.exception(f"Error generating AI description: {e}")
+        logger.exception("Error generating AI description: %s", e)
         raise HTTPException(status_code=500, detail="Failed to generate playlist description.")
 
 # Refined endpoint
@@ -724,12 +2080,12 @@ async def generate_ai_cover(playlist_id: str, session_data: dict = Depends(get_c
     MAX_BYTES = 256 * 1024  # spotify limit
 
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
+        async with http_client(timeout=120.0) as client:
             # 1) Fetch playlist name for context
             playlist_resp = await client.get(f"{API_BASE}/playlists/{playlist_id}", headers=headers_spotify)
             playlist_resp.raise_for_status()
             playlist_name = playlist_resp.json().get("name", "a playlist")
-            logger.info(f"Generating cover for playlist '{playlist_name}' ({playlist_id})")
+            logger.info("Generating cover for playlist '%s' (%s)", playlist_name, playlist_id)
 
             # 2) Ask OpenRouter (Grok) for a short visual prompt
             prompt_input = (
@@ -742,6 +2098,7 @@ async def generate_ai_cover(playlist_id: str, session_data: dict = Depends(get_c
                 "messages": [{"role": "user", "content": prompt_input}],
                 "max_tokens": 50,
             }
+            note_upstream("openrouter")
             resp_prompt = await client.post(
                 "https://openrouter.ai/api/v1/chat/completions",
                 headers=headers_openrouter,
@@ -756,25 +2113,26 @@ async def generate_ai_cover(playlist_id: str, session_data: dict = Depends(get_c
             visual_prompt = visual_prompt[: idx + 1].strip()
 
             logger.info("Got visual prompt from AI.")
-            logger.debug(f"Visual prompt: {visual_prompt}")
+            logger.debug("Visual prompt: %s", visual_prompt)
 
             # 3) Call Clipdrop to generate image (send JSON)
             clipdrop_url = "https://clipdrop-api.co/text-to-image/v1"
             headers_clipdrop = {"x-api-key": clipdrop_key, "Content-Type": "application/json"}
             clip_payload = {"prompt": visual_prompt}
+            note_upstream("clipdrop")
             resp_image = await client.post(clipdrop_url, headers=headers_clipdrop, json=clip_payload, timeout=120.0)
             resp_image.raise_for_status()
             image_bytes = resp_image.content
             ct = resp_image.headers.get("content-type", "<unknown>")
-            logger.info(f"Clipdrop returned content-type={ct}, size_bytes={len(image_bytes)}")
+            logger.info("Clipdrop returned content-type=%s, size_bytes=%d", ct, len(image_bytes))
 
             # Save raw clipdrop bytes for inspection (dev)
             try:
                 with open(raw_debug_path, "wb") as f:
                     f.write(image_bytes)
-                logger.debug(f"Saved raw Clipdrop bytes to {raw_debug_path}")
+                logger.debug("Saved raw Clipdrop bytes to %s", raw_debug_path)
             except Exception as e:
-                logger.warning(f"Could not save raw debug image: {e}")
+                logger.warning("Could not save raw debug image: %s", e)
 
             # 4) Convert to JPEG and compress until <= MAX_BYTES
             jpeg_bytes = None
@@ -794,7 +2152,7 @@ async def generate_ai_cover(playlist_id: str, session_data: dict = Depends(get_c
                     # fallback if optimize not supported
                     img.save(buf, format="JPEG", quality=quality)
                 data = buf.getvalue()
-                logger.debug(f"Try quality={quality} -> size={len(data)}")
+                logger.debug("Try quality=%d -> size=%d", quality, len(data))
                 if len(data) <= MAX_BYTES:
                     jpeg_bytes = data
                     break
@@ -808,7 +2166,7 @@ async def generate_ai_cover(playlist_id: str, session_data: dict = Depends(get_c
                     buf = BytesIO()
                     img2.save(buf, format="JPEG", quality=60, optimize=True)
                     data = buf.getvalue()
-                    logger.debug(f"After resize -> size={len(data)}")
+                    logger.debug("After resize -> size=%d", len(data))
                     if len(data) <= MAX_BYTES:
                         jpeg_bytes = data
                         img = img2
@@ -823,13 +2181,14 @@ async def generate_ai_cover(playlist_id: str, session_data: dict = Depends(get_c
             try:
                 with open(jpeg_debug_path, "wb") as f:
                     f.write(jpeg_bytes)
-                logger.info(f"Saved compressed debug image to {jpeg_debug_path} (size={len(jpeg_bytes)})")
+                logger.info("Saved compressed debug image to %s (size=%d)", jpeg_debug_path, len(jpeg_bytes))
             except Exception as e:
-                logger.warning(f"Could not write compressed debug image: {e}")
+                logger.warning("Could not write compressed debug image: %s", e)
 
             # 5) Upload to Spotify (raw JPEG bytes)
             b64_image = base64.b64encode(jpeg_bytes).decode("utf-8")
 
+            note_upstream("spotify")
             headers_upload = headers_spotify.copy()
             headers_upload["Content-Type"] = "image/jpeg"
             upload_resp = await client.put(
@@ -840,10 +2199,11 @@ async def generate_ai_cover(playlist_id: str, session_data: dict = Depends(get_c
             )
 
             if upload_resp.status_code not in (200, 202):
-                logger.error("Spotify upload failed", {"status": upload_resp.status_code, "text": upload_resp.text})
+                logger.error("Spotify upload failed: status=%s text=%s", upload_resp.status_code, truncate_payload(upload_resp.text))
                 raise HTTPException(status_code=upload_resp.status_code, detail=f"Spotify image upload failed: {upload_resp.text}")
 
             logger.info("Spotify upload accepted.")
+            invalidate_playlist_cache(session_data, playlist_id)
 
             # 6) Wait briefly for Spotify CDN to update, then fetch playlist details
             await asyncio.sleep(2)
@@ -852,17 +2212,17 @@ async def generate_ai_cover(playlist_id: str, session_data: dict = Depends(get_c
             images = final_details_resp.json().get("images", [])
             new_image_url = images[0]["url"] if images else None
 
-            logger.info(f"Returning imageUrl: {new_image_url}")
+            logger.info("Returning imageUrl: %s", new_image_url)
             return {"imageUrl": new_image_url}
 
     except httpx.HTTPStatusError as e:
         # external API error: Clipdrop/OpenRouter/Spotify network response with error code
-        logger.exception(f"Error generating AI cover - HTTP: {e.response.status_code} {e.response.text}")
+        logger.exception("Error generating AI cover - HTTP: %s %s", e.response.status_code, truncate_payload(e.response.text))
         # If it's an external provider error, surface the message but map to 502 (bad gateway)
         raise HTTPException(status_code=502, detail=f"External API error: {e.response.text}")
     except HTTPException:
         # re-raise HTTPErrors we created above
         raise
     except Exception as e:
-        logger.exception(f"Unhandled error generating AI cover: {e}")
+        logger.exception("Unhandled error generating AI cover: %s", e)
         raise HTTPException(status_code=500, detail="Failed to generate playlist cover.")
\ No newline at end of file
@@ -0,0 +1,104 @@
+# Benchmark for the response compression middleware in api/index.py.
+# Sends real requests through the app (httpx.ASGITransport, upstream Spotify mocked in-process)
+# and prints bytes on the wire and CPU time per request for each encoding we can produce:
+# cold (the compressor runs) and cached (the compressed body is reused from the cache entry).
+# The response itself is a RESPONSE_CACHE hit in every case, so no upstream time is counted.
+#
+# Run from the backend folder:  python benchmarks/bench_compression.py
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import statistics
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+import index  # noqa: E402
+
+MARKETS = ["AD", "AE", "AR", "AT", "AU", "BE", "BG", "BR", "CA", "CH", "CL", "CO", "CZ", "DE", "DK", "ES", "FI", "FR", "GB", "US"] * 9
+
+
+def fake_track(i: int) -> dict:
+    """Roughly the shape (and size) of one item from Spotify's /me/top/tracks."""
+    artist = {"id": f"artist{i % 17:018d}", "name": f"Artist {i % 17}", "type": "artist",
+              "uri": f"spotify:artist:artist{i % 17:018d}",
+              "external_urls": {"spotify": f"https://open.spotify.com/artist/artist{i % 17:018d}"}}
+    return {
+        "id": f"track{i:019d}", "name": f"Some Song Title {i}", "duration_ms": 180000 + i, "popularity": i % 100,
+        "explicit": False, "available_markets": MARKETS, "uri": f"spotify:track:track{i:019d}",
+        "external_urls": {"spotify": f"https://open.spotify.com/track/track{i:019d}"},
+        "artists": [artist],
+        "album": {"id": f"album{i % 23:019d}", "name": f"Album {i % 23}", "available_markets": MARKETS,
+                  "artists": [artist], "release_date": "2020-01-01",
+                  "images": [{"url": f"https://i.scdn.co/image/ab67616d0000b273{i:024d}", "height": h, "width": h}
+                             for h in (640, 300, 64)]},
+    }
+
+
+ROUNDS = 100
+PATH = "/me/top/tracks?time_range=medium_term"
+
+
+async def upstream(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={"items": [fake_track(i) for i in range(50)]})
+
+
+_client_init = httpx.AsyncClient.__init__
+
+
+def _mocked_init(self, *args, **kwargs):
+    kwargs.setdefault("transport", httpx.MockTransport(upstream))
+    _client_init(self, *args, **kwargs)
+
+
+def drop_encoded_bodies() -> None:
+    for entry in index.RESPONSE_CACHE.values():
+        entry["encoded"] = {}
+
+
+async def bench(client: httpx.AsyncClient, encoding: str) -> dict:
+    """
+    Bytes on the wire and median CPU ms per request to PATH, for identity, cold and cached.
+    The three kinds are interleaved, so a noisy machine skews them all the same way.
+    """
+    cpu = {"identity": [], "cold": [], "cached": []}
+    size = {}
+    for _ in range(ROUNDS):
+        for kind in cpu:
+            if kind == "cold":
+                drop_encoded_bodies()
+            accept_encoding = "identity" if kind == "identity" else encoding
+            headers = {"Authorization": "Bearer bench", "Accept-Encoding": accept_encoding}
+            start = time.process_time()
+            response = await client.get(PATH, headers=headers)
+            cpu[kind].append(time.process_time() - start)
+            assert response.status_code == 200 and response.headers.get("content-encoding", "identity") == accept_encoding
+            size[kind] = response.num_bytes_downloaded
+    return {kind: (size[kind], statistics.median(cpu[kind]) * 1000) for kind in cpu}
+
+
+async def main() -> None:
+    httpx.AsyncClient.__init__ = _mocked_init
+    index.logger.setLevel(logging.ERROR)
+    index.AUTH_SESSIONS["bench"] = {"access_token": "b", "user_id": "bench", "expires_at": time.time() + 3600}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=index.app), base_url="http://bench") as client:
+        await client.get(PATH, headers={"Authorization": "Bearer bench"})  # fills RESPONSE_CACHE
+        print(f"{PATH}, min size threshold {index.COMPRESSION_MIN_BYTES} bytes, median of {ROUNDS} requests")
+        for encoding in ("gzip", "br", "zstd"):
+            if index.choose_encoding(encoding) != encoding:
+                print(f"{encoding:>8} | not installed")
+                continue
+            results = await bench(client, encoding)
+            size, identity_ms = results["identity"]
+            compressed, cold_ms = results["cold"]
+            _, cached_ms = results["cached"]
+            print(f"{encoding:>8} | {size:>7,} -> {compressed:>6,} bytes on the wire ({compressed / size:5.1%})"
+                  f" | CPU/request: identity {identity_ms:6.2f} ms, cold {cold_ms:6.2f} ms, cached {cached_ms:6.2f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+# Benchmark for the logging pipeline in api/index.py.
+# Compares the time the request path spends on logging per request:
+#   before: synchronous file handler, f-strings, full OpenRouter body at INFO
+#   after:  QueueHandler (write happens on the listener thread), lazy %-args,
+#           payload sampled at PAYLOAD_LOG_SAMPLE_RATE and capped at PAYLOAD_LOG_MAX_CHARS
+#
+# Run from the backend folder:  python benchmarks/bench_logging.py
+import os
+import sys
+import time
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+import index  # noqa: E402
+
+REQUESTS = 2000
+BODY = '{"choices": [{"message": {"content": "' + "x" * 200_000 + '"}}]}'  # a large OpenRouter response
+
+
+def before(log: logging.Logger) -> None:
+    playlist_name, playlist_id = "Road Trip", "37i9dQZF1DXcBWIGoYBM5M"
+    log.info(f"Generating cover for playlist '{playlist_name}' ({playlist_id})")
+    log.debug(f"Visual prompt: {BODY[:200]}")
+    log.info("OpenRouter status: %s", 200)
+    log.info("OpenRouter body: %s", BODY)
+
+
+def after(log: logging.Logger) -> None:
+    playlist_name, playlist_id = "Road Trip", "37i9dQZF1DXcBWIGoYBM5M"
+    log.info("Generating cover for playlist '%s' (%s)", playlist_name, playlist_id)
+    log.debug("Visual prompt: %s", BODY[:200])
+    log.info("OpenRouter status: %s", 200)
+    index.log_payload("OpenRouter body", BODY)
+
+
+def run(label: str, fn, log: logging.Logger) -> None:
+    ctx_token = index.REQUEST_LOG_CONTEXT.set({"route": "POST /bench", "upstream": "openrouter", "start": time.perf_counter()})
+    try:
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            fn(log)
+        per_request_us = (time.perf_counter() - start) / REQUESTS * 1e6
+    finally:
+        index.REQUEST_LOG_CONTEXT.reset(ctx_token)
+    print(f"{label:<40} {per_request_us:9.1f} us/request on the request path")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        sync_logger = logging.getLogger("bench.sync")
+        sync_logger.propagate = False
+        sync_logger.setLevel(logging.INFO)
+        sync_handler = logging.FileHandler(os.path.join(tmp, "sync.log"))
+        sync_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+        sync_logger.addHandler(sync_handler)
+        run("before: sync handler, full payloads", before, sync_logger)
+        sync_handler.close()
+
+        # Same pipeline as the app, just writing to a file instead of stderr
+        listener = index.LOG_LISTENER
+        original_handlers = listener.handlers
+        listener.stop()
+        file_handler = logging.FileHandler(os.path.join(tmp, "queued.log"))
+        file_handler.setFormatter(original_handlers[0].formatter)
+        listener.handlers = (file_handler,)
+        listener.start()
+        run(f"after: queued, payload sampled at {index.PAYLOAD_LOG_SAMPLE_RATE:g}", after, index.logger)
+        listener.stop()  # drains the queue
+        file_handler.close()
+        listener.handlers = original_handlers
+        listener.start()
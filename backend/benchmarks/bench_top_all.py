@@ -0,0 +1,91 @@
+# Benchmark for /me/top/all against the per-range /me/top/{type} calls in api/index.py.
+# Upstream Spotify is mocked in-process (with a fixed latency), so nothing leaves the machine.
+# Reports bytes on the wire (raw and gzip) and wall-clock latency with a cold cache.
+#
+# Run from the backend folder:  python benchmarks/bench_top_all.py
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import statistics
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+import index  # noqa: E402
+from bench_compression import fake_track  # noqa: E402
+
+SPOTIFY_DELAY = 0.08  # seconds per upstream call
+ROUNDS = 10
+# Top tracks overlap heavily between ranges, like they do for real listeners
+TRACK_WINDOWS = {"short_term": range(0, 50), "medium_term": range(20, 70), "long_term": range(35, 85)}
+ARTIST_WINDOWS = {"short_term": range(0, 50), "medium_term": range(10, 60), "long_term": range(20, 70)}
+
+
+def fake_artist(i: int) -> dict:
+    return {"id": f"artist{i % 17:018d}" if i < 17 else f"artist{i:018d}", "name": f"Artist {i}", "type": "artist",
+            "genres": ["indie pop", "bedroom pop", "art pop"], "popularity": i % 100, "followers": {"total": 1000 + i},
+            "images": [{"url": f"https://i.scdn.co/image/ab6761610000e5eb{i:024d}", "height": h, "width": h} for h in (640, 320, 160)],
+            "external_urls": {"spotify": f"https://open.spotify.com/artist/artist{i:018d}"}}
+
+
+async def upstream(request: httpx.Request) -> httpx.Response:
+    await asyncio.sleep(SPOTIFY_DELAY)
+    type = request.url.path.rsplit("/", 1)[1]
+    time_range = request.url.params["time_range"]
+    if type == "tracks":
+        return httpx.Response(200, json={"items": [fake_track(i) for i in TRACK_WINDOWS[time_range]]})
+    return httpx.Response(200, json={"items": [fake_artist(i) for i in ARTIST_WINDOWS[time_range]]})
+
+
+_client_init = httpx.AsyncClient.__init__
+
+
+def _mocked_init(self, *args, **kwargs):
+    kwargs.setdefault("transport", httpx.MockTransport(upstream))
+    _client_init(self, *args, **kwargs)
+
+
+async def main() -> None:
+    httpx.AsyncClient.__init__ = _mocked_init
+    index.logger.setLevel(logging.ERROR)
+    index.AUTH_SESSIONS["bench"] = {"access_token": "b", "user_id": "bench", "expires_at": time.time() + 3600}
+    headers = {"Authorization": "Bearer bench"}
+    per_range_paths = [f"/me/top/{type}?time_range={r}" for type in ("tracks", "artists") for r in index.TIME_RANGES]
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=index.app), base_url="http://bench") as client:
+        async def per_range(concurrent: bool) -> tuple:
+            if concurrent:
+                responses = await asyncio.gather(*[client.get(path, headers=headers) for path in per_range_paths])
+            else:
+                responses = [await client.get(path, headers=headers) for path in per_range_paths]
+            return responses
+
+        async def all_in_one() -> tuple:
+            return [await client.get("/me/top/all", headers=headers)]
+
+        results = {}
+        for label, run in (("6x /me/top/{type}, sequential", lambda: per_range(False)),
+                           ("6x /me/top/{type}, concurrent", lambda: per_range(True)),
+                           ("1x /me/top/all", all_in_one)):
+            timings = []
+            for _ in range(ROUNDS):
+                index.RESPONSE_CACHE.clear()  # cold: every upstream call is paid
+                start = time.perf_counter()
+                responses = await run()
+                timings.append(time.perf_counter() - start)
+            raw = sum(len(r.content) for r in responses)
+            gzipped = sum(len(index.compress_body(r.content, "gzip")) for r in responses)
+            results[label] = raw
+            print(f"{label:<32} {raw:>9,} bytes raw  {gzipped:>7,} bytes gzip  "
+                  f"median {statistics.median(timings) * 1000:7.1f} ms")
+
+    per_range_bytes = results["6x /me/top/{type}, concurrent"]
+    all_bytes = results["1x /me/top/all"]
+    print(f"payload saved by normalizing: {1 - all_bytes / per_range_bytes:.1%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+# Load scenario for admission control in api/index.py.
+# A burst of AI cover generations (slow OpenRouter/Clipdrop, Pillow work on the
+# worker) runs next to a steady stream of cheap /me/top/tracks reads, once with
+# the AI class effectively unlimited and once with the configured limits.
+# Upstreams are mocked in-process, so nothing leaves the machine.
+#
+# Run from the backend folder:  python benchmarks/load_admission.py
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+from io import BytesIO
+
+import httpx
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+os.environ.setdefault("CLIPDROP_API_KEY", "bench")
+import index  # noqa: E402
+
+AI_USERS = 30            # each fires one cover generation at t=0
+READ_DURATION = 8.0      # seconds of steady reads
+READ_INTERVAL = 0.05     # one read every 50ms
+AI_UPSTREAM_DELAY = 1.0  # OpenRouter / Clipdrop latency
+SPOTIFY_DELAY = 0.02
+
+
+def make_cover() -> bytes:
+    """A 1024x1024 noisy PNG: the worst case for the JPEG recompression loop."""
+    rng = random.Random(0)
+    img = Image.frombytes("RGB", (1024, 1024), bytes(rng.getrandbits(8) for _ in range(1024 * 1024 * 3)))
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+COVER = make_cover()
+
+
+async def upstream(request: httpx.Request) -> httpx.Response:
+    host, path = request.url.host, request.url.path
+    if host == "openrouter.ai":
+        await asyncio.sleep(AI_UPSTREAM_DELAY)
+        return httpx.Response(200, json={"choices": [{"message": {"content": "A neon city at dusk."}}]})
+    if host == "clipdrop-api.co":
+        await asyncio.sleep(AI_UPSTREAM_DELAY)
+        return httpx.Response(200, content=COVER, headers={"content-type": "image/png"})
+    await asyncio.sleep(SPOTIFY_DELAY)
+    if path.endswith("/images"):
+        return httpx.Response(202)
+    if path.startswith("/v1/playlists/"):
+        return httpx.Response(200, json={"name": "Bench", "images": [{"url": "https://i.scdn.co/x"}]})
+    return httpx.Response(200, json={"items": [{"id": f"t{i}", "name": f"Track {i}"} for i in range(50)]})
+
+
+_client_init = httpx.AsyncClient.__init__
+
+
+def _mocked_init(self, *args, **kwargs):
+    kwargs.setdefault("transport", httpx.MockTransport(upstream))
+    _client_init(self, *args, **kwargs)
+
+
+def percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))] * 1000 if values else float("nan")
+
+
+async def scenario(label: str) -> None:
+    for state in index.ADMISSION_STATE.values():
+        state["semaphore"] = None
+    transport = httpx.ASGITransport(app=index.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        async def ai_job(token: str) -> int:
+            r = await client.post("/playlist/p1/ai-cover", headers={"Authorization": f"Bearer {token}"})
+            return r.status_code
+
+        async def read(scheduled: float) -> float:
+            r = await client.get("/me/top/tracks", headers={"Authorization": "Bearer reader"})
+            r.raise_for_status()
+            # Measured from when the read was due, so time stuck behind a blocked loop counts
+            return time.perf_counter() - scheduled
+
+        async def reader() -> list:
+            # Open loop: one read every READ_INTERVAL no matter how slow the previous ones are
+            start = time.perf_counter()
+            tasks = []
+            for k in range(int(READ_DURATION / READ_INTERVAL)):
+                scheduled = start + k * READ_INTERVAL
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                tasks.append(asyncio.ensure_future(read(scheduled)))
+            return await asyncio.gather(*tasks)
+
+        ai_tasks = [asyncio.ensure_future(ai_job(f"user{i}")) for i in range(AI_USERS)]
+        reads = await reader()
+        statuses = await asyncio.gather(*ai_tasks)
+
+    outcome = {code: statuses.count(code) for code in sorted(set(statuses))}
+    print(f"{label:<28} reads={len(reads):4d}  p50={percentile(reads, 0.5):7.1f}ms  "
+          f"p95={percentile(reads, 0.95):7.1f}ms  max={max(reads) * 1000:7.1f}ms  ai statuses={outcome}")
+
+
+async def main() -> None:
+    httpx.AsyncClient.__init__ = _mocked_init
+    index.logger.setLevel(logging.ERROR)
+    index.PREFETCH_ENABLED = False
+    index.RESPONSE_CACHE_TTL = 0  # every read goes "upstream"
+    future = time.time() + 3600
+    index.AUTH_SESSIONS["reader"] = {"access_token": "r", "user_id": "reader", "expires_at": future}
+    for i in range(AI_USERS):
+        index.AUTH_SESSIONS[f"user{i}"] = {"access_token": f"a{i}", "user_id": f"user{i}", "expires_at": future}
+
+    configured = dict(index.ADMISSION_CLASSES["ai"])
+    index.ADMISSION_CLASSES["ai"].update(limit=10_000, queue=10_000)
+    await scenario("AI class unlimited")
+    index.ADMISSION_CLASSES["ai"].update(configured)
+    await scenario(f"AI limit={configured['limit']} queue={configured['queue']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())